@@ -10,73 +10,383 @@
 # Average engagement time per active user, Bounce rate, Add to carts,
 # Checkouts, Ecommerce purchases, Items purchased, Total revenue
 
+import hashlib
+import re
+
 import streamlit as st
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import plotly.express as px
 import plotly.graph_objects as go
 
+try:
+    from numba import njit
+except ImportError:  # optional: falls back to the NumPy ratios below
+    njit = None
+
+try:
+    import datashader as ds
+    from datashader import transfer_functions as tf
+except ImportError:  # optional: large scatters fall back to WebGL
+    ds = None
+
+# Filtered frames are only read downstream; let pandas defer copies until a write
+# (copy-on-write is opt-in from pandas 1.5 and always on from 3.0)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 st.set_page_config(
     page_title="Geographic Metrics Dashboard",
     layout="wide",
     page_icon=":bar_chart:"
 )
 
-@st.cache_data
-def load_data(uploaded_file):
-    df = pd.read_csv(uploaded_file)
+# Switch the engagement scatter to WebGL from this many points on
+MIN_SCATTERGL_ROWS = 1000
+
+# ...and rasterize it server-side (needs datashader) from this many on
+MIN_DATASHADER_ROWS = 10_000
+
+# GA4 count metrics; parsed straight to int32 where the export allows it
+COUNT_COLS = [
+    "Active users","New users","Returning users","Engaged sessions",
+    "Add to carts","Checkouts","Ecommerce purchases","Items purchased"
+]
+
+# Anything that is not part of a plain decimal number ("$", ",", spaces, ...)
+_REV_RE = re.compile(r"[^0-9.\-]")
+
+
+def _file_digest(uploaded_file):
+    return hashlib.md5(uploaded_file.getvalue()).hexdigest()
+
+
+def upload_digest(uploaded_file):
+    # Hash each upload once per session; reruns reuse it via the uploader's file_id
+    cached = st.session_state.get("_digest")
+    if cached is None or cached[0] != uploaded_file.file_id:
+        cached = (uploaded_file.file_id, _file_digest(uploaded_file))
+        st.session_state["_digest"] = cached
+    return cached[1]
+
+
+def _ratio(num, den):
+    return np.divide(num, den, out=np.full(len(num), np.nan), where=den > 0)
+
+
+def rasterize_scatter(df, x, y, weight, width=800, height=600):
+    # Aggregate points into a width x height grid and return it as an RGBA image trace
+    agg = ds.Canvas(plot_width=width, plot_height=height).points(df, x, y, agg=ds.sum(weight))
+    img = tf.shade(agg, cmap=["#c6dbef", "#08306b"], how="eq_hist")
+    rgba = img.data.view(np.uint8).reshape(img.shape + (4,))
+    xs, ys = agg.coords[x].to_numpy(), agg.coords[y].to_numpy()
+    return go.Image(z=rgba, colormodel="rgba", zmax=[255, 255, 255, 255], x0=xs[0], dx=xs[1] - xs[0],
+                    y0=ys[0], dy=ys[1] - ys[0], hoverinfo="skip")
+
+
+def _funnel_numpy(active, atc, co, ep, items, rev):
+    return (_ratio(rev, ep), _ratio(rev, active), _ratio(atc, active),
+            _ratio(co, atc), _ratio(ep, co), _ratio(items, ep))
+
+
+if njit is not None:
+    # All six ratios in a single pass over the input columns.
+    @njit(cache=True)
+    def _funnel(active, atc, co, ep, items, rev):
+        n = len(active)
+        out = np.full((6, n), np.nan)
+        for i in range(n):
+            if ep[i] > 0:
+                out[0, i] = rev[i] / ep[i]
+                out[5, i] = items[i] / ep[i]
+            if active[i] > 0:
+                out[1, i] = rev[i] / active[i]
+                out[2, i] = atc[i] / active[i]
+            if atc[i] > 0:
+                out[3, i] = co[i] / atc[i]
+            if co[i] > 0:
+                out[4, i] = ep[i] / co[i]
+        return out
+else:
+    _funnel = _funnel_numpy
+
+
+def _read_csv(uploaded_file):
+    # Arrow's multi-threaded parser; falls back to pandas (which also strips
+    # "1,234"-style thousands separators) when a count column is not plain int32
+    try:
+        table = pacsv.read_csv(
+            pa.BufferReader(uploaded_file.getvalue()),
+            convert_options=pacsv.ConvertOptions(column_types={c: pa.int32() for c in COUNT_COLS})
+        )
+    except pa.ArrowInvalid:
+        uploaded_file.seek(0)
+        return pd.read_csv(uploaded_file, thousands=",")
+    return table.to_pandas()
+
+
+# Keyed on the file digest (the file itself is not hashed again) and persisted
+# to disk so re-uploading the same CSV in this or a later session skips parsing.
+@st.cache_data(persist="disk", show_spinner=False)
+def load_data(df_key, _uploaded_file):
+    df = _read_csv(_uploaded_file)
     # Clean revenue to numeric
     if "Total revenue" in df.columns:
-        df["Total revenue (num)"] = (
-            df["Total revenue"]
-            .astype(str)
-            .str.replace(r"[^0-9.\-]", "", regex=True)
-            .replace("", np.nan)
-            .astype(float)
-        )
+        if pd.api.types.is_numeric_dtype(df["Total revenue"]):
+            df["Total revenue (num)"] = df["Total revenue"].astype(float)
+        else:
+            # Exports repeat the same few strings ("$0.00", ...) a lot, so clean
+            # the distinct values once and map them back through the codes.
+            rev = df["Total revenue"].astype("category")
+            cleaned = pd.to_numeric(
+                rev.cat.categories.astype(str).str.replace(_REV_RE, "", regex=True),
+                errors="coerce"
+            ).to_numpy(dtype=float)
+            # Missing values have code -1, which picks the trailing NaN; this also
+            # covers an all-empty column (Arrow reads it as null, so no categories)
+            df["Total revenue (num)"] = np.append(cleaned, np.nan)[rev.cat.codes.to_numpy()]
     else:
         df["Total revenue (num)"] = 0.0
 
     # Normalize column names (strip, lower) and keep originals
     df.columns = [c.strip() for c in df.columns]
 
-    # Precompute useful metrics
-    # Safety against divide-by-zero
-    df["AOV"] = np.where(df["Ecommerce purchases"].replace(0, np.nan).notna(),
-                         df["Total revenue (num)"] / df["Ecommerce purchases"].replace(0, np.nan),
-                         np.nan)
-
-    df["Revenue / Active User"] = np.where(df["Active users"]>0,
-                                           df["Total revenue (num)"] / df["Active users"],
-                                           np.nan)
-
-    # Funnel rates
-    df["ATC rate"] = np.where(df["Active users"]>0,
-                              df["Add to carts"] / df["Active users"],
-                              np.nan)
-    df["Checkout rate (from ATC)"] = np.where(df["Add to carts"]>0,
-                                              df["Checkouts"] / df["Add to carts"],
-                                              np.nan)
-    df["Purchase rate (from Checkout)"] = np.where(df["Checkouts"]>0,
-                                                   df["Ecommerce purchases"] / df["Checkouts"],
-                                                   np.nan)
-    df["Units per order"] = np.where(df["Ecommerce purchases"]>0,
-                                     df["Items purchased"] / df["Ecommerce purchases"],
-                                     np.nan)
-
     # Ensure numeric types
     numeric_cols = [
         "Active users","New users","Returning users","Engaged sessions",
         "Average engagement time per active user","Bounce rate","Add to carts",
-        "Checkouts","Ecommerce purchases","Items purchased","Total revenue (num)",
-        "AOV","Revenue / Active User","ATC rate","Checkout rate (from ATC)",
-        "Purchase rate (from Checkout)","Units per order"
+        "Checkouts","Ecommerce purchases","Items purchased","Total revenue (num)"
     ]
+    # Counts that were present but not numeric are reported rather than passed off as 0
+    bad_counts = 0
     for c in numeric_cols:
         if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
+            raw = df[c]
+            if not pd.api.types.is_numeric_dtype(raw):
+                # read_csv only applies thousands="," to columns it parses as numbers
+                raw = raw.str.replace(",", "", regex=False)
+            df[c] = pd.to_numeric(raw, errors="coerce")
+            if c in COUNT_COLS:
+                bad_counts += int((df[c].isna() & raw.notna()).sum())
+
+    # Precompute useful metrics
+    # Safety against divide-by-zero: rows with a zero (or missing) denominator stay NaN
+    cols = ["Active users","Add to carts","Checkouts","Ecommerce purchases",
+            "Items purchased","Total revenue (num)"]
+    aov, rpu, atc_rate, co_rate, pur_rate, upo = _funnel(
+        *(np.ascontiguousarray(df[c].to_numpy(dtype=np.float64)) for c in cols)
+    )
+
+    df["AOV"] = aov
+    df["Revenue / Active User"] = rpu
+
+    # Funnel rates
+    df["ATC rate"] = atc_rate
+    df["Checkout rate (from ATC)"] = co_rate
+    df["Purchase rate (from Checkout)"] = pur_rate
+    df["Units per order"] = upo
+
+    # Halve memory and chart payloads. Revenue stays float64: float32 cannot
+    # hold cents once a country passes ~$130k.
+    count_cols = [c for c in COUNT_COLS if c in df.columns]
+    df[count_cols] = df[count_cols].fillna(0).astype(np.int32)
+    rate_cols = [c for c in ["AOV","Revenue / Active User","ATC rate","Checkout rate (from ATC)",
+                             "Purchase rate (from Checkout)","Units per order","Bounce rate",
+                             "Average engagement time per active user"]
+                 if c in df.columns]
+    df[rate_cols] = df[rate_cols].astype(np.float32)
+
+    # Integer codes make the country list, isin() filter and groupbys cheap
+    df["Country"] = df["Country"].astype("category")
+
+    # Sort once here so every "top by X" view just slices: rows are kept in
+    # Active users order and the revenue order (NaN last) is returned alongside
+    df = df.iloc[np.argsort(-df["Active users"].to_numpy(), kind="stable")].reset_index(drop=True)
+    order_revenue = np.argsort(-df["Total revenue (num)"].to_numpy(), kind="stable")
+
+    return df, order_revenue, bad_counts
+
+# The frame itself (leading underscore) is not hashed; df_key identifies it
+@st.cache_data(show_spinner=False, max_entries=32)
+def filter_and_kpis(df_key, selected, _df, _order_revenue):
+    mask = _df["Country"].isin(selected).to_numpy()
+    sub = _df.loc[mask]
+    # Carry the precomputed revenue order over to the filtered row positions
+    order = _order_revenue
+    sub_order = (np.cumsum(mask) - 1)[order[mask[order]]]
+    # All four header totals in one axis-0 reduction
+    kpi = np.nansum(
+        sub[["Active users","New users","Returning users","Total revenue (num)"]].to_numpy(dtype=np.float64),
+        axis=0
+    )
+    kpis = (int(kpi[0]), int(kpi[1]), int(kpi[2]), float(kpi[3]))
+    return sub, sub_order, kpis
+
+
+# Same key as filter_and_kpis: the filtered frame only changes with file + selection
+@st.cache_data(show_spinner=False, max_entries=32)
+def funnel_table(df_key, selected, columns, _df):
+    # Rows are already in Active users order (see load_data)
+    return _df[list(columns)].reset_index(drop=True)
+
+
+# --------------------
+# Figure builders
+# --------------------
+# Figures are cached as objects (cache_resource) on the same file + selection key,
+# plus top_n where it matters, so a cache hit skips Plotly's trace validation.
+# Traces are built from graph_objects with plain ndarray arguments.
+
+ENG_TITLE = "Engagement: Bounce Rate vs. Avg Engagement Time"
+
+
+def _top_users(df, n):
+    return df.head(n)
+
+
+def _top_revenue(df, order_revenue, n):
+    return df.iloc[order_revenue[:n]]
+
+
+@st.cache_resource(max_entries=32)
+def build_users_bar(df_key, selected, top_n, _df):
+    top_df = _top_users(_df, top_n)
+    # Plain int32/float ndarrays go over the wire as base64 typed arrays
+    users = top_df["Active users"].to_numpy(dtype=np.int32)
+    fig = go.Figure(
+        go.Bar(x=top_df["Country"].to_numpy(), y=users, text=users,
+               texttemplate="%{text:,}", textposition="outside")
+    )
+    fig.update_layout(title=f"Top {min(top_n, len(top_df))} Countries by Active Users",
+                      yaxis_title="Active Users", xaxis_title="Country")
+    return fig
+
+
+@st.cache_resource(max_entries=32)
+def build_new_returning(df_key, selected, top_n, _df):
+    top_df = _top_users(_df, top_n)
+    countries = top_df["Country"].to_numpy()
+    # One trace per user type straight from the columns, no long-form melt
+    fig = go.Figure([
+        go.Bar(name=utype, x=countries, y=top_df[utype].to_numpy())
+        for utype in ["New users", "Returning users"]
+    ])
+    fig.update_layout(barmode="stack", title="New vs Returning (Top Countries)",
+                      xaxis_title="Country", yaxis_title="Users",
+                      legend_title_text="User Type")
+    return fig
+
+
+@st.cache_resource(max_entries=32)
+def build_engagement(df_key, selected, _df):
+    x, y = "Bounce rate", "Average engagement time per active user"
+    if ds is not None and len(_df) >= MIN_DATASHADER_ROWS:
+        fig = go.Figure(rasterize_scatter(_df, x, y, "Active users"))
+        # Rows run from the smallest y upwards, so keep the y axis the usual way round,
+        # and drop go.Image's square-pixel lock so the grid fills the plot area
+        fig.update_yaxes(autorange=True, scaleanchor=False, constrain="range")
+        fig.update_xaxes(constrain="range")
+        fig.update_layout(title=f"{ENG_TITLE} (rasterized)")
+    else:
+        # SVG scatter stalls past ~1k markers; WebGL keeps restyles fast
+        trace = go.Scattergl if len(_df) >= MIN_SCATTERGL_ROWS else go.Scatter
+        sizes = _df["Active users"].to_numpy(np.float32)
+        fig = go.Figure(
+            trace(
+                x=_df[x].to_numpy(np.float32),
+                y=_df[y].to_numpy(np.float32),
+                mode="markers",
+                marker=dict(size=sizes, sizemode="area",
+                            sizeref=2.0 * max(float(sizes.max(initial=0)), 1.0) / 20 ** 2),
+                text=_df["Country"].to_numpy(),
+                hovertemplate="<b>%{text}</b><br>Bounce rate=%{x}<br>"
+                              "Avg engagement time=%{y}<extra></extra>"
+            )
+        )
+        fig.update_layout(title=ENG_TITLE)
+    fig.update_layout(xaxis_tickformat=".0%", xaxis_title="Bounce Rate",
+                      yaxis_title="Avg Engagement Time per Active User (sec or min)")
+    return fig
+
+
+@st.cache_resource(max_entries=32)
+def build_funnel(df_key, selected, _df):
+    # Funnel (counts) for selected countries aggregated
+    steps = ["Add to carts", "Checkouts", "Ecommerce purchases"]
+    totals = np.nansum(_df[steps].to_numpy(dtype=np.float64), axis=0)
+    fig = go.Figure(go.Funnel(x=totals, y=steps))
+    fig.update_layout(title="Global Funnel (Selected Countries)",
+                      xaxis_title="Count", yaxis_title="Step")
+    return fig
+
+
+@st.cache_resource(max_entries=32)
+def build_revenue_bar(df_key, selected, top_n, _df, _order_revenue):
+    top_rev_df = _top_revenue(_df, _order_revenue, top_n)
+    revenue = top_rev_df["Total revenue (num)"].to_numpy(dtype=np.float64)
+    fig = go.Figure(
+        go.Bar(x=top_rev_df["Country"].to_numpy(), y=revenue, text=revenue,
+               texttemplate="$%{text:,.0f}", textposition="outside")
+    )
+    fig.update_layout(title=f"Top {top_n} Countries by Revenue",
+                      yaxis_title="Total Revenue (USD)", xaxis_title="Country")
+    return fig
+
+
+@st.cache_resource(max_entries=32)
+def build_monetization(df_key, selected, top_n, _df, _order_revenue):
+    top_rev_df = _top_revenue(_df, _order_revenue, top_n)
+    countries = top_rev_df["Country"].to_numpy()
+    fig = go.Figure([
+        go.Bar(name="AOV ($)", x=countries, y=top_rev_df["AOV"].to_numpy(np.float32)),
+        go.Bar(name="Revenue per Active User ($)", x=countries,
+               y=top_rev_df["Revenue / Active User"].to_numpy(np.float32)),
+    ])
+    fig.update_layout(barmode="group", title="AOV vs Revenue per Active User",
+                      xaxis_title="Country", yaxis_title="Value",
+                      legend_title_text="Metric")
+    return fig
+
+
+@st.cache_resource(max_entries=32)
+def build_treemap(df_key, selected, _df):
+    fig = go.Figure(
+        go.Treemap(
+            labels=_df["Country"].to_numpy(),
+            parents=[""] * len(_df),
+            values=_df["Total revenue (num)"].fillna(0).to_numpy(dtype=np.float64),
+            branchvalues="total"
+        )
+    )
+    fig.update_layout(title="Revenue Share")
+    return fig
+
+
+@st.cache_resource(max_entries=32)
+def build_map(df_key, selected, _df):
+    fig = go.Figure(
+        go.Choropleth(
+            locations=_df["Country"].to_numpy(),
+            z=_df["Active users"].to_numpy(dtype=np.int32),
+            locationmode="country names",
+            colorscale=px.colors.sequential.Blues,
+            colorbar_title="Active users",
+            hovertemplate="<b>%{location}</b><br>Active users=%{z:,}<extra></extra>"
+        )
+    )
+    fig.update_layout(title="Active Users by Country")
+    return fig
+
+
+def session_fig(name, builder, *args):
+    # Built on first use, so sections still render one by one on a miss
+    figs = st.session_state["_figs"]
+    if name not in figs:
+        figs[name] = builder(*args)
+    return figs[name]
 
-    return df
 
 st.title("Geographic Metrics Dashboard")
 st.caption("Interactive insights for audience, engagement, funnel, revenue, and geography.")
@@ -95,20 +405,31 @@ if uploaded is None:
     st.info("Please upload your CSV to begin.")
     st.stop()
 
-df = load_data(uploaded)
+df_key = upload_digest(uploaded)
+df, order_revenue, bad_counts = load_data(df_key, uploaded)
+if bad_counts:
+    st.warning(f"{bad_counts:,} count values in the CSV could not be parsed as numbers "
+               "and are shown as 0.")
 
 # Country filter
-all_countries = sorted(df["Country"].unique().tolist())
+all_countries = df["Country"].cat.categories.tolist()  # already sorted
+if not all_countries:
+    st.warning("The uploaded file has no rows. Upload a CSV with at least one country.")
+    st.stop()
 selected_countries = st.sidebar.multiselect("Countries", all_countries, default=all_countries)
-df = df[df["Country"].isin(selected_countries)].copy()
+selected_key = tuple(sorted(selected_countries))
+df, order_revenue, (total_active, total_new, total_returning, total_revenue) = filter_and_kpis(
+    df_key, selected_key, df, order_revenue
+)
+
+# Nothing to chart: skip building every figure on an empty frame
+if df.empty:
+    st.warning("No countries selected. Pick at least one country in the sidebar.")
+    st.stop()
 
 # --------------------
 # KPI Header
 # --------------------
-total_active = int(df["Active users"].sum())
-total_new = int(df["New users"].sum())
-total_returning = int(df["Returning users"].sum())
-total_revenue = float(df["Total revenue (num)"].sum())
 
 col1, col2, col3, col4 = st.columns(4)
 col1.metric("Active Users", f"{total_active:,}")
@@ -118,34 +439,25 @@ col4.metric("Total Revenue", f"${total_revenue:,.2f}")
 
 st.divider()
 
+# Widget events that land on the same file/selection/Top N (e.g. slider
+# debounces) reuse this session's figures without touching any cache
+fp = (df_key, selected_key, top_n)
+if st.session_state.get("_fp") != fp or "_figs" not in st.session_state:
+    st.session_state.update(_fp=fp, _figs={})
+
 # --------------------
 # Section 1: Audience Overview
 # --------------------
 st.subheader("1) Audience Overview")
-top_df = df.sort_values("Active users", ascending=False).head(top_n)
-
 a1, a2 = st.columns([2, 1])
 with a1:
-    fig_users = px.bar(
-        top_df,
-        x="Country",
-        y="Active users",
-        title=f"Top {min(top_n, len(top_df))} Countries by Active Users",
-        text="Active users"
-    )
-    fig_users.update_traces(texttemplate="%{text:,}", textposition="outside")
-    fig_users.update_layout(yaxis_title="Active Users", xaxis_title="Country")
-    st.plotly_chart(fig_users, use_container_width=True)
+    st.plotly_chart(session_fig("users", build_users_bar, df_key, selected_key, top_n, df),
+                    use_container_width=True)
 
 with a2:
     st.markdown("**New vs Returning Users**")
-    nr_df = top_df.melt(id_vars=["Country"], value_vars=["New users","Returning users"],
-                        var_name="User Type", value_name="Users")
-    fig_nr = px.bar(
-        nr_df, x="Country", y="Users", color="User Type",
-        barmode="stack", title="New vs Returning (Top Countries)"
-    )
-    st.plotly_chart(fig_nr, use_container_width=True)
+    st.plotly_chart(session_fig("new_returning", build_new_returning, df_key, selected_key, top_n, df),
+                    use_container_width=True)
 
 st.divider()
 
@@ -155,17 +467,7 @@ st.divider()
 st.subheader("2) Engagement Quality")
 st.caption("Bounce rate vs. average engagement time, bubble size = active users")
 
-fig_eng = px.scatter(
-    df,
-    x="Bounce rate",
-    y="Average engagement time per active user",
-    size="Active users",
-    hover_name="Country",
-    title="Engagement: Bounce Rate vs. Avg Engagement Time",
-)
-fig_eng.update_layout(xaxis_tickformat=".0%", xaxis_title="Bounce Rate",
-                      yaxis_title="Avg Engagement Time per Active User (sec or min)")
-st.plotly_chart(fig_eng, use_container_width=True)
+st.plotly_chart(session_fig("engagement", build_engagement, df_key, selected_key, df), use_container_width=True)
 
 st.divider()
 
@@ -175,26 +477,14 @@ st.divider()
 st.subheader("3) Conversion Funnel")
 st.caption("Add to carts → Checkouts → Purchases → Units per order")
 
-# Funnel (counts) for selected countries aggregated
-agg_counts = {
-    "Add to carts": df["Add to carts"].sum(),
-    "Checkouts": df["Checkouts"].sum(),
-    "Ecommerce purchases": df["Ecommerce purchases"].sum(),
-}
-funnel_df = pd.DataFrame({
-    "Step": list(agg_counts.keys()),
-    "Count": list(agg_counts.values())
-})
-
-fig_funnel = px.funnel(funnel_df, x="Count", y="Step", title="Global Funnel (Selected Countries)")
-st.plotly_chart(fig_funnel, use_container_width=True)
+st.plotly_chart(session_fig("funnel", build_funnel, df_key, selected_key, df), use_container_width=True)
 
 # Rates table by country
 rate_cols = ["ATC rate","Checkout rate (from ATC)","Purchase rate (from Checkout)","Units per order"]
 show_cols = ["Country","Active users","Add to carts","Checkouts","Ecommerce purchases","Items purchased"] + rate_cols
 st.markdown("**Funnel KPIs by Country**")
 st.dataframe(
-    df[show_cols].sort_values("Active users", ascending=False).reset_index(drop=True),
+    funnel_table(df_key, selected_key, tuple(show_cols), df),
     use_container_width=True
 )
 
@@ -207,56 +497,24 @@ st.subheader("4) Revenue & Monetization")
 
 r1, r2 = st.columns([2, 1])
 with r1:
-    fig_rev = px.bar(
-        df.sort_values("Total revenue (num)", ascending=False).head(top_n),
-        x="Country",
-        y="Total revenue (num)",
-        title=f"Top {top_n} Countries by Revenue",
-        text="Total revenue (num)"
-    )
-    fig_rev.update_traces(texttemplate="$%{text:,.0f}", textposition="outside")
-    fig_rev.update_layout(yaxis_title="Total Revenue (USD)", xaxis_title="Country")
-    st.plotly_chart(fig_rev, use_container_width=True)
+    st.plotly_chart(session_fig("revenue", build_revenue_bar, df_key, selected_key, top_n, df,
+                                order_revenue), use_container_width=True)
 
 with r2:
     st.markdown("**AOV & Revenue per User (Top Countries)**")
-    monet_df = df.sort_values("Total revenue (num)", ascending=False).head(top_n)
-    monet_df = monet_df.assign(
-        **{
-            "AOV ($)": monet_df["AOV"],
-            "Revenue per Active User ($)": monet_df["Revenue / Active User"]
-        }
-    )
-    fig_monet = px.bar(
-        monet_df.melt(id_vars=["Country"], value_vars=["AOV ($)","Revenue per Active User ($)"],
-                      var_name="Metric", value_name="Value"),
-        x="Country", y="Value", color="Metric", barmode="group",
-        title="AOV vs Revenue per Active User"
-    )
-    st.plotly_chart(fig_monet, use_container_width=True)
+    st.plotly_chart(session_fig("monetization", build_monetization, df_key, selected_key, top_n, df,
+                                order_revenue), use_container_width=True)
 
 # Revenue share treemap (robust implementation)
 st.markdown("**Revenue Share by Country**")
 try:
-    import plotly.graph_objects as go
-    treemap_df = df[["Country", "Total revenue (num)"]].copy()
-    treemap_df["Total revenue (num)"] = treemap_df["Total revenue (num)"].fillna(0)
-
-    fig_tree = go.Figure(
-        go.Treemap(
-            labels=treemap_df["Country"],
-            parents=[""] * len(treemap_df),
-            values=treemap_df["Total revenue (num)"],
-            branchvalues="total"
-        )
-    )
-    fig_tree.update_layout(title="Revenue Share")
-    st.plotly_chart(fig_tree, use_container_width=True)
+    st.plotly_chart(session_fig("treemap", build_treemap, df_key, selected_key, df),
+                    use_container_width=True)
 
 except Exception as e:
     st.warning(f"Treemap failed to render (falling back to bar chart). Error: {e}")
     fig_rev_fallback = px.bar(
-        df.sort_values("Total revenue (num)", ascending=False),
+        df.iloc[order_revenue],
         x="Country", y="Total revenue (num)",
         title="Revenue Share (Fallback)",
         text="Total revenue (num)"
@@ -272,16 +530,7 @@ st.divider()
 st.subheader("Geography: Active Users by Country")
 st.caption("Hover for values. Location mode uses country names.")
 
-fig_map = px.choropleth(
-    df,
-    locations="Country",
-    locationmode="country names",
-    color="Active users",
-    hover_name="Country",
-    title="Active Users by Country",
-    color_continuous_scale=px.colors.sequential.Blues
-)
-st.plotly_chart(fig_map, use_container_width=True)
+st.plotly_chart(session_fig("map", build_map, df_key, selected_key, df), use_container_width=True)
 
 st.write("")
 st.info("Tip: Use the sidebar to filter countries and adjust the Top N.")